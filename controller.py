@@ -1353,6 +1353,9 @@ if __name__ == "__main__":
     arg_parser.add_argument("--vicon", action="store_true", help="localize using Vicon and save tracking data")
     arg_parser.add_argument("--virtual-vicon", action="store_true", help="localize using synthetic Vicon data and save tracking data")
     arg_parser.add_argument("--save-vicon", action="store_true", help="save Vicon tracking data only")
+    arg_parser.add_argument("--vicon-cpu", type=int, default=None, help="pin the Vicon thread to this CPU core")
+    arg_parser.add_argument("--vicon-priority", type=int, default=None,
+                            help="run the Vicon thread under SCHED_FIFO with this priority, requires CAP_SYS_NICE")
     arg_parser.add_argument("--save-camera", action="store_true",
                             help="save camera at 1/10 of original fps, works with --localize")
     arg_parser.add_argument("--stream-camera", action="store_true",
@@ -1441,7 +1444,7 @@ if __name__ == "__main__":
 
         # vicon_thread = ViconWrapper(callback=c.send_vicon_position, log_level=log_level)
         vicon_thread = ViconWrapper(callback=c.send_vicon_full, log_level=log_level, labeled_object=False,
-                                    log_file=args.log_file)
+                                    log_file=args.log_file, cpu=args.vicon_cpu, rt_priority=args.vicon_priority)
         vicon_thread.start()
     elif args.virtual_vicon:
         from vicon import VirtualViconWrapper
@@ -1450,7 +1453,8 @@ if __name__ == "__main__":
     elif args.save_vicon:
         from vicon import ViconWrapper
 
-        vicon_thread = ViconWrapper(log_level=log_level, log_file=args.log_file)
+        vicon_thread = ViconWrapper(log_level=log_level, log_file=args.log_file, cpu=args.vicon_cpu,
+                                    rt_priority=args.vicon_priority)
         vicon_thread.start()
 
     c.request_data()
@@ -1,25 +1,47 @@
-import re
+from array import array
+
+import numpy as np
 import pandas as pd
 
+# Parse the latency values. Every latency line has the fixed layout
+# "System Latency: <sys> ms. FC Latency: <fc>, Vicon Latency: <vicon>", so the values sit at known
+# positions after the prefix and can be split out without a regex. Newer logs append
+# ", Slot Wait: <wait>", which is already included in the system latency.
+prefix = 'System Latency: '
+system_latency = array('f')
+fc_latency = array('f')
+vicon_latency = array('f')
+
 # Updated log from user
 # Replace 'your_file.txt' with the path to your text file
 with open('log/output.txt', 'r', encoding='utf-8') as file:
-    log_text = file.read()
+    for line in file:
+        start = line.find(prefix)
+        if start < 0:
+            continue
+        fields = line[start + len(prefix):].split(' ', 7)
+        if len(fields) != 8 or fields[1] != 'ms.' or fields[3] != 'Latency:' or fields[6] != 'Latency:':
+            continue
+        try:
+            system, fc = float(fields[0]), float(fields[4].rstrip(','))
+            # The Vicon value is followed by the slot wait field, or by the ANSI reset code and newline
+            vicon = float(fields[7].partition('\x1b')[0].partition(',')[0])
+        except ValueError:
+            continue
+        system_latency.append(system)
+        fc_latency.append(fc)
+        vicon_latency.append(vicon)
 
-# Parse the latency values
-pattern = re.compile(r'System Latency: ([\d.]+) ms\. FC Latency: ([\d.]+), Vicon Latency: ([\d.]+)')
-matches = pattern.findall(log_text)
-
-# Convert to DataFrame
-df = pd.DataFrame(matches, columns=["System Latency", "FC Latency", "Vicon Latency"]).astype(float)
+# Wrap the buffers in a DataFrame without copying
+df = pd.DataFrame({
+    "System Latency": np.frombuffer(system_latency, dtype=np.float32),
+    "FC Latency": np.frombuffer(fc_latency, dtype=np.float32),
+    "Vicon Latency": np.frombuffer(vicon_latency, dtype=np.float32),
+}, copy=False)
 
 # Calculate min, max, and average
-summary = {
-    "Latency Type": ["System Latency", "FC Latency", "Vicon Latency"],
-    "Min (ms)": [df[col].min() for col in df.columns],
-    "Max (ms)": [df[col].max() for col in df.columns],
-    "Avg (ms)": [df[col].mean() for col in df.columns],
-}
+summary = df.agg(['min', 'max', 'mean']).T.rename(
+    columns={'min': 'Min (ms)', 'max': 'Max (ms)', 'mean': 'Avg (ms)'})
+summary.index.name = "Latency Type"
 
 print(summary)
-
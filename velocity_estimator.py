@@ -26,7 +26,12 @@ class VelocityEstimator:
                 self.velocity[1] = (1 - self.filter_alpha) * self.velocity[1] + self.filter_alpha * vy_raw
                 self.velocity[2] = (1 - self.filter_alpha) * self.velocity[2] + self.filter_alpha * vz_raw
 
-        self.prev_position = [x, y, z]
+        if self.prev_position is None:
+            self.prev_position = [x, y, z]
+        else:
+            self.prev_position[0] = x
+            self.prev_position[1] = y
+            self.prev_position[2] = z
         self.prev_time = timestamp
 
         return self.velocity
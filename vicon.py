@@ -1,36 +1,130 @@
-import json
 import logging
 import os.path
 import threading
 import time
+from array import array
 from datetime import datetime
 
+import numpy as np
 from pyvicon_datastream import PyViconDatastream, StreamMode, Direction
 
 from log import LoggerFactory
 
 VICON_PC_IP = '192.168.1.39'
 VICON_ADDRESS = f"{VICON_PC_IP}:801"
+# Backoff (seconds) after get_frame fails, which in ServerPush mode only happens while the stream is down
+POLL_BACKOFF_MIN = 0.001
+POLL_BACKOFF_MAX = 0.005
+# Upper bound on frames kept in memory (about 1 h at 200 Hz), older frames are dropped beyond this
+MAX_LOGGED_FRAMES = 720000
+# Consecutive callback failures (about 1 s at 200 Hz) after which the wrapper stops
+MAX_CALLBACK_FAILURES = 200
+
+
+class PositionLog:
+    """Column buffers of Vicon frames, appended per frame and packed into one structured array on save.
+
+    Once max_frames frames are held the columns stop growing and wrap around, overwriting the oldest frames.
+
+    Frames are stamped with time.monotonic_ns(); the wall-clock offset is sampled once so the saved
+    log still carries wall-clock milliseconds that line up with the other experiment logs.
+    Load a saved log with np.load(file_path), e.g. frames["tvec"][:, 0] for every X position.
+    """
+    SAVED_DTYPE = np.dtype([("frame_id", np.int64), ("tvec", np.float64, 3), ("time", np.float64)])
+
+    def __init__(self, max_frames=MAX_LOGGED_FRAMES):
+        self.frame_ids = array('q')
+        self.tvecs = array('d')
+        self.times_ns = array('q')
+        self.max_frames = max_frames
+        # Frames overwritten after the columns reached max_frames
+        self.dropped = 0
+        self.wall_offset_ns = time.time_ns() - time.monotonic_ns()
+
+        # A closure over the columns is called per frame, which avoids the attribute lookups of a method
+        frame_ids = self.frame_ids
+        ids_append = frame_ids.append
+        tvecs_extend = self.tvecs.extend
+        times_append = self.times_ns.append
+        overwrite = self._overwrite
+
+        def append(frame_id, tvec, time_ns):
+            if len(frame_ids) < max_frames:
+                ids_append(frame_id)
+                tvecs_extend(tvec)
+                times_append(time_ns)
+            else:
+                overwrite(frame_id, tvec, time_ns)
+
+        self.append = append
+
+    def _overwrite(self, frame_id, tvec, time_ns):
+        index = self.dropped % self.max_frames
+        self.frame_ids[index] = frame_id
+        self.tvecs[3 * index], self.tvecs[3 * index + 1], self.tvecs[3 * index + 2] = tvec
+        self.times_ns[index] = time_ns
+        self.dropped += 1
+
+    def to_array(self):
+        """Return the frames held as a SAVED_DTYPE array, oldest first."""
+        frames = np.empty(len(self.frame_ids), dtype=self.SAVED_DTYPE)
+        frames["frame_id"] = np.frombuffer(self.frame_ids, dtype=np.int64)
+        frames["tvec"] = np.frombuffer(self.tvecs, dtype=np.float64).reshape(-1, 3)
+        frames["time"] = (np.frombuffer(self.times_ns, dtype=np.int64) + self.wall_offset_ns) / 1e6
+        if self.dropped:
+            frames = np.roll(frames, -(self.dropped % self.max_frames))
+        return frames
+
+    def save(self, file_path):
+        """Write the frames as a structured .npy array with frame_id, tvec and wall-clock time (ms) fields."""
+        np.save(file_path, self.to_array())
 
 
 class ViconWrapper(threading.Thread):
-    def __init__(self, callback=None, log_level=logging.INFO, labeled_object=False, log_file=None):
+    def __init__(self, callback=None, log_level=logging.INFO, labeled_object=False, log_file=None, cpu=None,
+                 rt_priority=None):
         super().__init__()
         self.running = False
         self.logger = LoggerFactory("Vicon", level=log_level, log_file=log_file).get_logger()
-        self.callback = callback
-        self.position_log = []
+        self.callback = callback if callable(callback) else None
+        self.position_log = PositionLog()
         self.labeled_object = labeled_object
+        self.cpu = cpu
+        self.rt_priority = rt_priority
+        self._subject_name = None
+        self._root_segment = None
+        # Latest pose handed from the Vicon loop to the callback thread, newer poses overwrite older ones.
+        # Slots: x, y, z, roll, pitch, yaw, monotonic time (ns), Vicon latency (s), overwritten in place.
+        self._pose_ready = threading.Condition()
+        self._pose = [0.0, 0.0, 0.0, None, None, None, 0, None]
+        self._pose_pending = False
 
     def stop(self):
         self.running = False
         self.join()
 
+    def _set_scheduling(self):
+        """Pin the calling thread to self.cpu and run it under SCHED_FIFO at self.rt_priority, when set."""
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+                self.logger.info(f"Vicon thread pinned to CPU {self.cpu}.")
+            except (AttributeError, OSError, ValueError, OverflowError) as e:
+                self.logger.warning(f"Could not pin Vicon thread to CPU {self.cpu}: {e}")
+
+        if self.rt_priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.rt_priority))
+                self.logger.info(f"Vicon thread scheduled SCHED_FIFO with priority {self.rt_priority}.")
+            except (AttributeError, OSError, ValueError, OverflowError) as e:
+                self.logger.warning(f"Could not set SCHED_FIFO priority {self.rt_priority}: {e}")
+
     def run(self):
         self.running = True
 
         client = PyViconDatastream()
         self.logger.info("Client object created.")
+        consumer = None
 
         try:
             self.logger.info(f"Attempting to connect to Vicon server at {VICON_ADDRESS}...")
@@ -42,78 +136,35 @@ class ViconWrapper(threading.Thread):
                 client.enable_segment_data()
                 self.logger.info("Marker and Segment data enabled.")
 
-                subject_name = client.get_subject_name(0)
-                if subject_name:
-                    self.logger.info(f"\tSubject: {subject_name}")
+                # Subject and root segment names are fixed for the session, look them up once
+                self._subject_name = client.get_subject_name(0)
+                if self._subject_name:
+                    self._root_segment = client.get_subject_root_segment_name(self._subject_name)
+                    self.logger.info(f"\tSubject: {self._subject_name}")
             else:
                 client.enable_unlabeled_marker_data()
                 self.logger.info("Unlabeled marker data enabled.")
 
-            client.set_stream_mode(StreamMode.ClientPull)
-            self.logger.info("Stream mode set to ClientPull.")
+            # ServerPush makes get_frame block until the next frame arrives instead of polling for it
+            client.set_stream_mode(StreamMode.ServerPush)
+            self.logger.info("Stream mode set to ServerPush.")
 
             # Set axis mapping for standard coordinate systems
             client.set_axis_mapping(Direction.Forward, Direction.Left, Direction.Up)
 
             # latency = client.get_latency_total()
             # self.logger.info(f"Vicon Latency: {latency*1000} ms.")
-            while self.running:
-                if client.get_frame():
-                    frame_num = client.get_frame_number()
-                    # self.logger.debug(f"--- Frame {frame_num} ---")
-
-                    if self.labeled_object:
-                        object_count = client.get_subject_count()
-                        # self.logger.debug(f"\tSubject count: {object_count}")
-                    else:
-                        object_count = client.get_unlabeled_marker_count()
-                        self.logger.debug(f"\tUnlabeled marker count: {object_count}")
-
-                    if object_count is not None and object_count == 1:
-                        translation = None
-                        rotation = None
-
-                        if self.labeled_object:
-                            subject_name = client.get_subject_name(0)
-                            if subject_name:
-                                self.logger.debug(f"\tSubject: {subject_name}")
-                                root_segment = client.get_subject_root_segment_name(subject_name)
-                                translation = client.get_segment_global_translation(subject_name, root_segment)
-                                rotation = client.get_segment_global_rotation_euler_xyz(subject_name, root_segment)
-                        else:
-                            translation = client.get_unlabeled_marker_global_translation(0)
-
-                        if translation is not None:
-                            now = time.time()
-                            pos_x, pos_y, pos_z = translation
-                            self.position_log.append({
-                                "frame_id": frame_num,
-                                "tvec": [pos_x, pos_y, pos_z],
-                                "time": now * 1000
-                            })
-                            fc_latency = -1
-                            if callable(self.callback):
-                                if rotation is not None:
-                                    # self.logger.info(f"Using Vicon For Attitude.")
-                                    fc_latency = self.callback(pos_x, pos_y, pos_z, rotation[0], rotation[1], rotation[2], timestamp=now)
-                                else:
-                                    fc_latency = self.callback(pos_x, pos_y, pos_z, None, None, None, timestamp=now)
-
-                            # if fc_latency > 0:
-                            #     try:
-                            #         vicon_latency = client.get_latency_total()
-                            #         self.logger.debug(f"System Latency: {fc_latency + vicon_latency * 1000} ms. FC Latency: {fc_latency}, Vicon Latency: {vicon_latency*1000}")
-                            #     except Exception as e:
-                            #         self.logger.error(f"Latency Check error: {e}")
-
-                            self.logger.debug(
-                                f"\tPosition (mm): X={pos_x:.2f}, Y={pos_y:.2f}, Z={pos_z:.2f}, "
-                                f"Roll:{rotation[0]:.2f}, Pitch:{rotation[1]:.2f}, Yaw:{rotation[2]:.2f}")
-                        else:
-                            self.logger.warning(f"\tPosition (mm): Occluded or no data")
+            publish = self._make_publisher(client)
+            if self.callback is not None:
+                consumer = threading.Thread(target=self._deliver, daemon=True)
+                consumer.start()
+            # Applied after starting the consumer, so it does not inherit this thread's CPU mask and policy
+            self._set_scheduling()
 
-                else:
-                    time.sleep(1/50)
+            if self.labeled_object:
+                self._run_labeled(client, publish)
+            else:
+                self._run_unlabeled(client, publish)
 
         except KeyboardInterrupt:
             self.logger.error("\nScript interrupted by user.")
@@ -121,24 +172,205 @@ class ViconWrapper(threading.Thread):
             self.logger.error(f"An unexpected error occurred: {e}")
 
         finally:
+            if consumer is not None:
+                with self._pose_ready:
+                    self.running = False
+                    self._pose_ready.notify()
+                consumer.join()
+
             now = datetime.now()
             formatted = now.strftime("%H_%M_%S_%m_%d_%Y")
-            file_path = os.path.join("logs", f"vicon_{formatted}.json")
-            with open(file_path, "w") as f:
-                json.dump({"frames": self.position_log}, f)
+            file_path = os.path.join("logs", f"vicon_{formatted}.npy")
+            self.position_log.save(file_path)
             self.logger.info(f"Vicon log saved in {file_path}")
+            if self.position_log.dropped:
+                self.logger.warning(f"Dropped the oldest {self.position_log.dropped} frames from the Vicon log.")
 
             if client.is_connected():
                 client.disconnect()
                 self.logger.info("Disconnected from Vicon server.")
 
+    def _make_publisher(self, client):
+        """Bind the per-frame logging and pose hand-off once, outside the frame loop."""
+        deliver = self.callback is not None
+        pose_ready = self._pose_ready
+        pose = self._pose
+        get_latency_total = client.get_latency_total
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        log_append = self.position_log.append
+        debug = self.logger.debug
+        monotonic_ns = time.monotonic_ns
+
+        def publish(frame_num, translation, rotation):
+            now_ns = monotonic_ns()
+            log_append(frame_num, translation, now_ns)
+
+            vicon_latency = None
+            if debug_enabled:
+                # Only needed for the System Latency line, which requires a callback reporting FC latency
+                if deliver:
+                    try:
+                        vicon_latency = get_latency_total()
+                    except Exception as e:
+                        self.logger.error("Latency Check error: %s", e)
+
+                pos_x, pos_y, pos_z = translation
+                if rotation is not None:
+                    debug("\tPosition (mm): X=%.2f, Y=%.2f, Z=%.2f, Roll:%.2f, Pitch:%.2f, Yaw:%.2f",
+                          pos_x, pos_y, pos_z, rotation[0], rotation[1], rotation[2])
+                else:
+                    debug("\tPosition (mm): X=%.2f, Y=%.2f, Z=%.2f", pos_x, pos_y, pos_z)
+
+            if deliver:
+                with pose_ready:
+                    pose[0], pose[1], pose[2] = translation
+                    if rotation is not None:
+                        pose[3], pose[4], pose[5] = rotation
+                    else:
+                        pose[3] = pose[4] = pose[5] = None
+                    pose[6] = now_ns
+                    pose[7] = vicon_latency
+                    self._pose_pending = True
+                    pose_ready.notify()
+
+        return publish
+
+    def _deliver(self):
+        """Feed the latest pose to the callback, so FC I/O does not hold up the next get_frame.
+
+        This only overlaps with the Vicon loop while pyvicon_datastream releases the GIL inside its
+        blocking calls (get_frame in ServerPush mode). A build that holds the GIL there would stall this
+        thread until each frame arrives, so check the binding before relying on the overlap.
+        """
+        callback = self.callback
+        pose_ready = self._pose_ready
+        pose = self._pose
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        debug = self.logger.debug
+        monotonic_ns = time.monotonic_ns
+        failures = 0
+        last_error = None
+
+        while True:
+            with pose_ready:
+                while not self._pose_pending and self.running:
+                    pose_ready.wait()
+                if not self._pose_pending:
+                    return
+                pos_x, pos_y, pos_z, roll, pitch, yaw, now_ns, vicon_latency = pose
+                self._pose_pending = False
+
+            try:
+                # Time the pose spent in the slot between the Vicon loop and this thread
+                slot_wait_ms = (monotonic_ns() - now_ns) / 1e6 if debug_enabled else 0
+                fc_latency = callback(pos_x, pos_y, pos_z, roll, pitch, yaw, timestamp=now_ns / 1e9)
+            except Exception as e:
+                failures += 1
+                if failures >= MAX_CALLBACK_FAILURES:
+                    # The flight controller gets no positions, so stop rather than keep recording frames
+                    self.logger.error("Callback failed on %d consecutive frames, stopping Vicon: %s",
+                                      failures, e)
+                    self.running = False
+                    return
+                # Log each distinct error once, a failing callback would otherwise log on every frame
+                error = repr(e)
+                if error != last_error:
+                    self.logger.error("Callback error: %s", e)
+                    last_error = error
+                continue
+            failures = 0
+
+            # Check the cheap debug flag first, and skip callbacks that do not report a numeric latency
+            if (debug_enabled and vicon_latency is not None and isinstance(fc_latency, (int, float))
+                    and fc_latency > 0):
+                vicon_latency_ms = vicon_latency * 1000
+                debug("System Latency: %.3f ms. FC Latency: %.3f, Vicon Latency: %.3f, Slot Wait: %.3f",
+                      fc_latency + vicon_latency_ms + slot_wait_ms, fc_latency, vicon_latency_ms,
+                      slot_wait_ms)
+
+    def _run_labeled(self, client, publish):
+        get_frame = client.get_frame
+        get_frame_number = client.get_frame_number
+        get_subject_count = client.get_subject_count
+        get_subject_name = client.get_subject_name
+        get_root_segment_name = client.get_subject_root_segment_name
+        get_translation = client.get_segment_global_translation
+        get_rotation = client.get_segment_global_rotation_euler_xyz
+        debug = self.logger.debug
+        warning = self.logger.warning
+        subject_name = self._subject_name
+        root_segment = self._root_segment
+
+        backoff = POLL_BACKOFF_MIN
+        while self.running:
+            if not get_frame():
+                time.sleep(backoff)
+                backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+                continue
+            backoff = POLL_BACKOFF_MIN
+
+            frame_num = get_frame_number()
+            # self.logger.debug(f"--- Frame {frame_num} ---")
+            object_count = get_subject_count()
+            # self.logger.debug(f"\tSubject count: {object_count}")
+            if object_count != 1:
+                continue
+
+            if not subject_name:
+                # The subject may not be known until the first frames arrive
+                subject_name = get_subject_name(0)
+                if subject_name:
+                    debug("\tSubject: %s", subject_name)
+                    root_segment = get_root_segment_name(subject_name)
+                    self._subject_name, self._root_segment = subject_name, root_segment
+
+            translation = None
+            rotation = None
+            if subject_name:
+                translation = get_translation(subject_name, root_segment)
+                rotation = get_rotation(subject_name, root_segment)
+
+            if translation is not None:
+                publish(frame_num, translation, rotation)
+            else:
+                warning("\tPosition (mm): Occluded or no data")
+
+    def _run_unlabeled(self, client, publish):
+        get_frame = client.get_frame
+        get_frame_number = client.get_frame_number
+        get_marker_count = client.get_unlabeled_marker_count
+        get_translation = client.get_unlabeled_marker_global_translation
+        debug = self.logger.debug
+        warning = self.logger.warning
+
+        backoff = POLL_BACKOFF_MIN
+        while self.running:
+            if not get_frame():
+                time.sleep(backoff)
+                backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+                continue
+            backoff = POLL_BACKOFF_MIN
+
+            frame_num = get_frame_number()
+            # self.logger.debug(f"--- Frame {frame_num} ---")
+            object_count = get_marker_count()
+            debug("\tUnlabeled marker count: %s", object_count)
+            if object_count != 1:
+                continue
+
+            translation = get_translation(0)
+            if translation is not None:
+                publish(frame_num, translation, None)
+            else:
+                warning("\tPosition (mm): Occluded or no data")
+
 class VirtualViconWrapper(threading.Thread):
     def __init__(self, callback=None, log_level=logging.INFO):
         super().__init__()
         self.running = False
         self.logger = LoggerFactory("Vicon", level=log_level).get_logger()
         self.callback = callback
-        self.position_log = []
+        self.position_log = PositionLog()
 
     def stop(self):
         self.running = False
@@ -153,12 +385,7 @@ class VirtualViconWrapper(threading.Thread):
             frame_num += 1
             pos_x, pos_y, pos_z = 0, 0, 10
             vel_x, vel_y, vel_z = 1, 1, 1
-            self.position_log.append({
-                "frame_id": frame_num,
-                "tvec": [pos_x, pos_y, pos_z],
-                "vel": [vel_x, vel_y, vel_z],
-                "time": time.time() * 1000
-            })
+            self.position_log.append(frame_num, (pos_x, pos_y, pos_z), time.monotonic_ns())
 
             if callable(self.callback):
                 self.callback([pos_x, pos_y, pos_z, vel_x, vel_y, vel_z])
@@ -168,9 +395,8 @@ class VirtualViconWrapper(threading.Thread):
             self.logger.warning(f"    Position (mm): Occluded or no data")
             now = datetime.now()
             formatted = now.strftime("%H_%M_%S_%m_%d_%Y")
-            file_path = os.path.join("logs", f"vicon_{formatted}.json")
-            with open(file_path, "w") as f:
-                json.dump({"frames": self.position_log}, f)
+            file_path = os.path.join("logs", f"vicon_{formatted}.npy")
+            self.position_log.save(file_path)
             self.logger.info(f"Vicon log saved in {file_path}")
 
 if __name__ == "__main__":